@@ -1,7 +1,8 @@
+import asyncio
 import httpx
-import pandas as pd
 import numpy as np
-import itertools
+from numba import njit, prange
+from scipy.special import ndtr
 from typing import List, Dict, Tuple, Optional
 from dataclasses import dataclass
 
@@ -14,6 +15,99 @@ class PropType:
     alt_lines: List[float] = None
     category: str = "standard"
 
+@dataclass(slots=True)
+class Parlay:
+    combined_probability: float
+    ev: float
+    prop_indices: Tuple[int, ...]  # Positions in the valid_props list the parlay was built from
+
+@njit(cache=True)
+def _leg_correlation(legs: np.ndarray, d: int, pair_correlation: np.ndarray) -> float:
+    # Correlation that leg d adds to the sub-parlay legs[:d]; pair_correlation is
+    # symmetric (both directions of a pair summed), so each unordered pair counts once
+    total = 0.0
+    for a in range(d):
+        total += pair_correlation[legs[a], legs[d]]
+    return total
+
+def _binomial_table(n: int, k: int) -> np.ndarray:
+    # binomial[a, b] == C(a, b) for a <= n, b <= k
+    binomial = np.zeros((n + 1, k + 1), dtype=np.int64)
+    binomial[:, 0] = 1
+    for a in range(1, n + 1):
+        binomial[a, 1:] = binomial[a - 1, 1:] + binomial[a - 1, :-1]
+    return binomial
+
+@njit(cache=True)
+def _unrank_combination(rank: int, n: int, binomial: np.ndarray, out: np.ndarray):
+    # Writes the rank-th len(out)-subset of range(n), in lexicographic order, into out
+    k = out.shape[0]
+    leg = 0
+    for i in range(k):
+        while binomial[n - leg - 1, k - i - 1] <= rank:
+            rank -= binomial[n - leg - 1, k - i - 1]
+            leg += 1
+        out[i] = leg
+        leg += 1
+
+@njit(cache=True)
+def _unrank_combinations(ranks: np.ndarray, n: int, k: int, binomial: np.ndarray) -> np.ndarray:
+    legs = np.empty((ranks.shape[0], k), dtype=np.int64)
+    for i in range(ranks.shape[0]):
+        _unrank_combination(ranks[i], n, binomial, legs[i])
+    return legs
+
+@njit(cache=True)
+def _next_combination(legs: np.ndarray, n: int) -> int:
+    # Advances legs to its lexicographic successor in place and returns the first
+    # position that changed; every position before it is untouched
+    k = legs.shape[0]
+    i = k - 1
+    while i >= 0 and legs[i] == n - k + i:
+        i -= 1
+    if i < 0:
+        return -1
+    legs[i] += 1
+    for j in range(i + 1, k):
+        legs[j] = legs[j - 1] + 1
+    return i
+
+_SCORE_CHUNK = 4096
+
+@njit(parallel=True, cache=True)
+def _score_combinations(log_probs: np.ndarray, evs: np.ndarray, pair_correlation: np.ndarray,
+                        k: int, binomial: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Correlation-adjusted log probability and EV of every k-leg parlay, indexed by rank
+    n = log_probs.shape[0]
+    total = binomial[n, k]
+    parlay_logs = np.empty(total, dtype=np.float32)
+    parlay_evs = np.empty(total, dtype=np.float32)
+    for chunk in prange((total + _SCORE_CHUNK - 1) // _SCORE_CHUNK):
+        start = chunk * _SCORE_CHUNK
+        legs = np.empty(k, dtype=np.int64)
+        _unrank_combination(start, n, binomial, legs)
+
+        # prefix_*[d] holds the sub-parlay of the first d legs; consecutive combinations
+        # share a prefix, so its log product, EV and correlation are reused and only
+        # the tail from `changed` on is re-accumulated
+        prefix_logs = np.zeros(k + 1, dtype=np.float32)
+        prefix_evs = np.zeros(k + 1, dtype=np.float32)
+        prefix_corrs = np.zeros(k + 1, dtype=np.float32)
+        changed = 0
+        for rank in range(start, min(start + _SCORE_CHUNK, total)):
+            for d in range(changed, k):
+                prefix_logs[d + 1] = prefix_logs[d] + log_probs[legs[d]]
+                prefix_evs[d + 1] = prefix_evs[d] + evs[legs[d]]
+                prefix_corrs[d + 1] = prefix_corrs[d] + _leg_correlation(legs, d, pair_correlation)
+            total_correlation = prefix_corrs[k]
+            if total_correlation <= -1:
+                parlay_logs[rank] = -np.inf
+            else:
+                parlay_logs[rank] = prefix_logs[k] + np.log1p(total_correlation)
+            parlay_evs[rank] = prefix_evs[k]
+            changed = _next_combination(legs, n)
+    return parlay_logs, parlay_evs
+
 class ComprehensiveSportsAnalyzer:
     SPORTS_PROPS = {
         'football': {
@@ -45,9 +139,21 @@ class ComprehensiveSportsAnalyzer:
     }
 
     def __init__(self):
-        self.client = httpx.Client(timeout=30.0)
+        self.client = httpx.Client(
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            http2=True
+        )
         self.correlation_matrix = self._initialize_correlation_matrix()
         self.variance_factors = self._initialize_variance_factors()
+        self.stat_ids = self._initialize_stat_ids()
+        self.correlation_table = self._build_correlation_table()
+        self.flat_tables = self._build_flat_tables()
+        self._stats_cache: Dict[Tuple[str, str], Tuple[float, float, float]] = {}
+        # Placeholder history drawn once per run, one row of 20 games per stat_key
+        self._hist = np.random.default_rng(0).normal(
+            loc=50, scale=10, size=(len(self.stat_ids), 20)
+        ).astype(np.float32)
 
     def _initialize_correlation_matrix(self) -> Dict:
         return {
@@ -73,116 +179,217 @@ class ComprehensiveSportsAnalyzer:
             }
         }
 
+    def _initialize_stat_ids(self) -> Dict[str, int]:
+        stat_ids = {}
+        for categories in self.SPORTS_PROPS.values():
+            for props in categories.values():
+                for prop in props:
+                    stat_ids.setdefault(prop.stat_key, len(stat_ids))
+        return stat_ids
+
+    def _build_correlation_table(self) -> np.ndarray:
+        # Dense (stat_id, stat_id) view of correlation_matrix for the jitted parlay math
+        table = np.zeros((len(self.stat_ids), len(self.stat_ids)), dtype=np.float32)
+        for categories in self.correlation_matrix.values():
+            for pairs in categories.values():
+                for (stat_a, stat_b), correlation in pairs.items():
+                    table[self.stat_ids[stat_a], self.stat_ids[stat_b]] = correlation
+        return table
+
+    def _build_flat_tables(self) -> Dict[str, Dict]:
+        # One row per (prop, line) of each sport so a whole sport is scored in one pass
+        tables = {}
+        for sport, categories in self.SPORTS_PROPS.items():
+            entries = [(category, prop) for category, props in categories.items() for prop in props]
+            rows = [
+                (prop_index, line)
+                for prop_index, (_, prop) in enumerate(entries)
+                for line in (prop.alt_lines or [prop.threshold])
+                if line is not None
+            ]
+            row_prop = np.array([prop_index for prop_index, _ in rows], dtype=np.intp)
+            tables[sport] = {
+                'entries': entries,
+                'stat_keys': [prop.stat_key for _, prop in entries],
+                'row_prop': row_prop,
+                'lines': np.array([line for _, line in rows], dtype=np.float32),
+                'row_variance': np.array(
+                    [self.variance_factors[entries[i][1].category] for i in row_prop],
+                    dtype=np.float32
+                ),
+                'row_threshold': np.array(
+                    [entries[i][1].prob_threshold for i in row_prop], dtype=np.float32
+                )
+            }
+        return tables
+
     def analyze_props(self, player_data: Dict, sport: str, 
                       min_correlation: float = -0.2) -> List[Dict]:
         valid_props = []
         
-        for category, props in self.SPORTS_PROPS[sport].items():
-            for prop in props:
-                for line in (prop.alt_lines or [prop.threshold]):
-                    if line is None:
-                        continue
-                        
-                    analysis = self._analyze_single_prop(
-                        player_data, prop, line, sport, category
-                    )
-                    
-                    if analysis and analysis['probability'] >= prop.prob_threshold:
-                        valid_props.append(analysis)
+        table = self.flat_tables[sport]
+        stats = self._get_stats(player_data, table['stat_keys'])
+
+        missing = (np.nan, np.nan, np.nan)
+        means, stds, trends = np.array(
+            [stats.get(stat_key, missing) for stat_key in table['stat_keys']], dtype=np.float32
+        ).T
+
+        matchup_factor = self._calculate_matchup_factor(player_data)
+        adjusted_means = means * matchup_factor * (1 + trends)
+
+        row_prop = table['row_prop']
+        lines = table['lines']
+        adjusted_stds = stds[row_prop] * table['row_variance']
+        probabilities = ndtr(-(lines - adjusted_means[row_prop]) / adjusted_stds)  # P(X > line)
+        evs = self._calculate_ev(probabilities, lines)
+
+        # Props without history (or with degenerate stats) come out as NaN; one mask
+        # drops them together with every line under its threshold
+        mask = (probabilities >= table['row_threshold']) & np.isfinite(probabilities)
+        survivors = np.nonzero(mask)[0]
+
+        survivor_props = row_prop[survivors]
+        for prop_index, line, probability, ev, trend in zip(
+            survivor_props, lines[survivors], probabilities[survivors],
+            evs[survivors], trends[survivor_props]
+        ):
+            category, prop = table['entries'][prop_index]
+            valid_props.append({
+                'prop_name': prop.name,
+                'line': line,
+                'probability': probability,
+                'ev': ev,
+                'trend': trend,
+                'category': category,
+                'stat_key': prop.stat_key
+            })
         
         return self._filter_correlated_props(valid_props, min_correlation)
 
+    def _filter_correlated_props(self, valid_props: List[Dict],
+                                 min_correlation: float) -> List[Dict]:
+        # Keeps props in order, dropping any whose correlation with an already kept
+        # prop (both directions summed) falls below min_correlation
+        kept = []
+        kept_ids = []
+        for prop in valid_props:
+            stat_id = self.stat_ids[prop['stat_key']]
+            correlations = (self.correlation_table[stat_id, kept_ids]
+                            + self.correlation_table[kept_ids, stat_id])
+            if np.all(correlations >= min_correlation):
+                kept.append(prop)
+                kept_ids.append(stat_id)
+        return kept
+
     def generate_optimal_parlays(self, valid_props: List[Dict], 
                                   min_picks: int = 2, max_picks: int = 5,
-                                  min_probability: float = 0.85) -> List[Dict]:
+                                  min_probability: float = 0.85) -> List[Parlay]:
         parlays = []
         
-        for n in range(min_picks, max_picks + 1):
-            for combo in itertools.combinations(valid_props, n):
-                parlay = self._analyze_parlay(combo)
-                if parlay['probability'] >= min_probability:
-                    parlays.append(parlay)
-        
-        return sorted(parlays, key=lambda x: x['ev'], reverse=True)
+        # Parallel arrays for the hot loop, with the most likely legs first so every
+        # bound below is a prefix of this order; `order` maps back to valid_props
+        probs = np.array([p['probability'] for p in valid_props], dtype=np.float32)
+        order = np.argsort(-probs, kind='stable')
+        probs = probs[order]
+        evs = np.array([p['ev'] for p in valid_props], dtype=np.float32)[order]
+        stat_ids = np.array(
+            [self.stat_ids[p['stat_key']] for p in valid_props], dtype=np.int32
+        )[order]
 
-    def _analyze_single_prop(self, player_data: Dict, prop: PropType, 
-                             line: float, sport: str, category: str) -> Dict:
-        historical = self._get_historical_data(player_data, prop.stat_key)
-        if not historical:
-            return None
+        # Correlation between every pair of ranked legs, gathered once instead of per combo;
+        # folding in the transpose lets the kernel add each unordered pair only once
+        pair_correlation = self.correlation_table[np.ix_(stat_ids, stat_ids)]
+        pair_correlation = pair_correlation + pair_correlation.T
+        np.fill_diagonal(pair_correlation, 0.0)
 
-        mean = np.mean(historical)
-        std = np.std(historical)
-        trend = self._calculate_trend(historical)
-        
-        matchup_factor = self._calculate_matchup_factor(player_data)
-        variance_factor = self.variance_factors[prop.category]
-        
-        adjusted_mean = mean * matchup_factor * (1 + trend)
-        adjusted_std = std * variance_factor
+        log_probs = np.log(probs)
+        cum_log = np.concatenate((np.zeros(1, dtype=np.float32), np.cumsum(log_probs)))
+        max_correlation = max(self.correlation_table.max(), 0.0)
 
-        probability = self._calculate_probability(adjusted_mean, adjusted_std, line)
-        ev = self._calculate_ev(probability, line)
+        log_target = np.float32(np.log(min_probability))
+        binomial = _binomial_table(len(order), max_picks)
 
-        return {
-            'prop_name': prop.name,
-            'line': line,
-            'probability': probability,
-            'ev': ev,
-            'trend': trend,
-            'category': category,
-            'stat_key': prop.stat_key
-        }
+        for n in range(min_picks, min(max_picks, len(order)) + 1):
+            # Correlation can lift a product by at most this much across n(n-1) ordered pairs
+            log_floor = log_target - np.float32(np.log1p(n * (n - 1) * max_correlation))
+            if cum_log[n] < log_floor:
+                continue  # Not even the n most likely legs can reach min_probability
+
+            # A leg past the top n-1 is only usable if it can still clear the floor
+            # alongside them; since legs are sorted, the usable ones form a prefix
+            num_legs = (n - 1) + np.count_nonzero(cum_log[n - 1] + log_probs[n - 1:] >= log_floor)
 
-    def _analyze_parlay(self, props: Tuple[Dict]) -> Dict:
-        total_correlation = self._calculate_total_correlation(props)
-        individual_probs = [p['probability'] for p in props]
-        combined_probability = self._calculate_combined_probability(individual_probs, total_correlation)
+            parlay_logs, parlay_evs = _score_combinations(
+                log_probs[:num_legs], evs[:num_legs], pair_correlation, n, binomial
+            )
+            survivors = np.nonzero(parlay_logs >= log_target)[0]
+            legs = order[_unrank_combinations(survivors, num_legs, n, binomial)]
+
+            parlays.extend(
+                Parlay(combined_probability, ev, tuple(combo))
+                for combo, combined_probability, ev in zip(
+                    legs.tolist(),
+                    np.exp(parlay_logs[survivors]).tolist(),
+                    parlay_evs[survivors].tolist()
+                )
+            )
+        
+        return sorted(parlays, key=lambda x: x.ev, reverse=True)
 
-        ev = self._calculate_combined_ev(props)
+    def _get_stats(self, player_data: Dict,
+                   stat_keys: List[str]) -> Dict[str, Tuple[float, float, float]]:
+        # (mean, std, trend) per stat, memoized on (player_id, stat_key); misses are batched
+        player_id = player_data.get('id')
+        # Payloads without an id (e.g. a roster-level response) must not share entries,
+        # so their stats are computed into a throwaway dict instead of the cache
+        cache = self._stats_cache if player_id is not None else {}
+        missing = []
+        histories = []
+        for stat_key in dict.fromkeys(stat_keys):
+            if (player_id, stat_key) in cache:
+                continue
+            historical = self._get_historical_data(player_data, stat_key)
+            if len(historical):
+                missing.append(stat_key)
+                histories.append(historical)
+
+        if missing:
+            series = np.array(histories)
+            computed = zip(series.mean(axis=1), series.std(axis=1), self._trend_batch(series))
+            for stat_key, stat in zip(missing, computed):
+                cache[(player_id, stat_key)] = stat
 
         return {
-            'combined_probability': combined_probability,
-            'ev': ev,
-            'props': [p['prop_name'] for p in props]
+            stat_key: cache[(player_id, stat_key)]
+            for stat_key in stat_keys
+            if (player_id, stat_key) in cache
         }
 
-    def _get_historical_data(self, player_data: Dict, stat_key: str) -> List[float]:
+    def _get_historical_data(self, player_data: Dict, stat_key: str) -> np.ndarray:
         # Placeholder: Replace with actual historical data fetching logic
-        return np.random.normal(loc=50, scale=10, size=20).tolist()
+        return self._hist[self.stat_ids[stat_key]]
 
-    def _calculate_trend(self, historical: List[float]) -> float:
-        return np.polyfit(range(len(historical)), historical, 1)[0]  # Simple linear trend
+    def _trend_batch(self, series: np.ndarray) -> np.ndarray:
+        # Closed-form OLS slope of every row against t = 0..n-1, no lstsq needed
+        n = series.shape[1]
+        t = np.arange(n)
+        t_mean = (n - 1) / 2
+        t_var = ((n * n - 1) / 12) * n  # sum((t - t_mean) ** 2)
+        centered = series - series.mean(axis=1, keepdims=True)
+        return (centered * (t - t_mean)).sum(axis=1) / t_var
 
     def _calculate_matchup_factor(self, player_data: Dict) -> float:
         return 1.0  # Placeholder, adjust based on matchup analysis
 
-    def _calculate_probability(self, adjusted_mean: float, adjusted_std: float, line: float) -> float:
-        z_score = (line - adjusted_mean) / adjusted_std
-        probability = 1 - (0.5 * (1 + np.erf(z_score / np.sqrt(2))))
-        return probability
-
     def _calculate_ev(self, probability: float, line: float) -> float:
         odds = line / 100  # Assuming American odds
         return (probability * odds) - (1 - probability)
 
-    def _calculate_total_correlation(self, props: Tuple[Dict]) -> float:
-        return sum(self.correlation_matrix['football']['passing'].get((p['stat_key'], p2['stat_key']), 0) 
-                   for p in props for p2 in props if p != p2)
-
-    def _calculate_combined_probability(self, individual_probs: List[float], total_correlation: float) -> float:
-        combined = 1.0
-        for prob in individual_probs:
-            combined *= prob
-        return combined * (1 + total_correlation)  # Adjust for correlation
-
-    def _calculate_combined_ev(self, props: Tuple[Dict]) -> float:
-        return sum(p['ev'] for p in props)
-
 # API Functions
-def fetch_teams(sport: str, league: str, season: str) -> List[Dict]:
+async def fetch_teams(client: httpx.AsyncClient, sport: str, league: str, season: str) -> List[Dict]:
     base_url = f'https://sports.core.api.espn.com/v2/sports/{sport}/leagues/{league}/seasons/{season}/teams'
-    response = httpx.get(base_url)
+    response = await client.get(base_url)
     
     if response.status_code == 200:
         teams_data = response.json()
@@ -194,8 +401,8 @@ def fetch_teams(sport: str, league: str, season: str) -> List[Dict]:
         return []
 
 
-def fetch_team_roster(team_url: str) -> Dict:
-    response = httpx.get(team_url)
+async def fetch_team_roster(client: httpx.AsyncClient, team_url: str) -> Dict:
+    response = await client.get(team_url)
     
     if response.status_code == 200:
         return response.json()
@@ -203,8 +410,8 @@ def fetch_team_roster(team_url: str) -> Dict:
         print(f"Error fetching team roster: {response.status_code}")
         return {}
 
-def fetch_players(athletes_url: str) -> Dict:
-    response = httpx.get(athletes_url)
+async def fetch_players(client: httpx.AsyncClient, athletes_url: str) -> Dict:
+    response = await client.get(athletes_url)
     
     if response.status_code == 200:
         return response.json()
@@ -212,17 +419,29 @@ def fetch_players(athletes_url: str) -> Dict:
         print(f"Error fetching players: {response.status_code}")
         return {}
 
-if __name__ == "__main__":
+async def main():
     analyzer = ComprehensiveSportsAnalyzer()
     
-    # Example usage:
-    teams = fetch_teams("football", "nfl", "2024")
-    for team in teams:
-        roster = fetch_team_roster(team['url'])
-        players = fetch_players(roster.get('athletes', []))
+    # One shared client so every request reuses the same HTTP/2 connections
+    limits = httpx.Limits(max_connections=64)
+    async with httpx.AsyncClient(timeout=30.0, http2=True, limits=limits) as client:
+        # Example usage:
+        teams = await fetch_teams(client, "football", "nfl", "2024")
+        rosters = await asyncio.gather(
+            *(fetch_team_roster(client, team['url']) for team in teams)
+        )
+        team_players = await asyncio.gather(
+            *(fetch_players(client, roster.get('athletes', [])) for roster in rosters)
+        )
+
+    for players in team_players:
         player_data = analyzer.analyze_props(players, "football")
         parlays = analyzer.generate_optimal_parlays(player_data)
 
         # Output parlays
         for parlay in parlays:
-            print(parlay)
+            props = [player_data[i]['prop_name'] for i in parlay.prop_indices]
+            print(parlay.combined_probability, parlay.ev, props)
+
+if __name__ == "__main__":
+    asyncio.run(main())